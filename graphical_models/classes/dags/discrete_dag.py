@@ -1,20 +1,19 @@
 # === BUILT-IN
 import itertools as itr
 from collections import defaultdict
-from copy import deepcopy
-from functools import reduce
+from functools import lru_cache, reduce
 from math import prod
 from typing import Dict, Hashable, List
 
 # === THIRD-PARTY
 import networkx as nx
 import numpy as np
+from numba import njit, prange
+import opt_einsum as oe
 import xgboost as xgb
-from einops import repeat, einsum
 from pgmpy.factors.discrete.CPD import TabularCPD
 from pgmpy.inference import BeliefPropagation, VariableElimination
 from pgmpy.models import BayesianNetwork
-from scipy.special import logsumexp
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from tqdm import tqdm
@@ -25,6 +24,10 @@ from graphical_models.classes.dags.functional_dag import FunctionalDAG
 from graphical_models.utils import core_utils
 
 
+# === SUM OF LOG ALPHABET SIZES ABOVE WHICH get_marginals_new OFFLOADS TO THE GPU
+CUQUANTUM_LOG_SIZE_THRESHOLD = np.log(1e7)
+
+
 def no_warn_log(x, eps=1e-10):
     ixs = x > eps
     res = np.log(x, where=ixs)
@@ -39,34 +42,22 @@ def add_repeated_nodes_marginal(
     node2dims: dict,
     cond_vals: int
 ):
-    marginal_nodes_no_repeats = [node for node in marginal_nodes if node not in cond_nodes]
     marginal_nodes_repeat = [node for node in marginal_nodes if node in cond_nodes]
-    
-    # === SET UP PATTERNS FOR START AND END DIMENSION
-    start_dims = " ".join([f"d{ix}" for ix in marginal_nodes_no_repeats])
-    end_dims = " ".join([
-        f"d{node}" if node in marginal_nodes_no_repeats else f"r{node}" 
-        for node in marginal_nodes
-    ])
-    
-    # === FOR EACH MARGINAL NODE THAT'S IN THE CONDITIONING SET, REPEAT
-    pattern = start_dims + " -> " + end_dims
-    repeats = {f"r{node}": node2dims[node] for node in marginal_nodes_repeat}
-    conditional = repeat(conditional, pattern, **repeats)
 
     # NOTE: THE BELOW NO LONGER APPLIES, SINCE WHETHER WE SHOULD SET CONDITIONAL = 0
     # DEPENDS ON WHAT THE CONDITIONING VALUE OF THE NODE IS
     if len(marginal_nodes_repeat) > 1:
         raise NotImplementedError
-    else:
-        rep_node = marginal_nodes_repeat[0]
-        cond_repeat_ix = cond_nodes.index(rep_node)
-        ones = (np.arange(node2dims[marginal_nodes_repeat[0]]) == cond_vals[cond_repeat_ix]).astype(int)
-        repeats = {f"d{node}": node2dims[node] for node in marginal_nodes if node != rep_node}
-        ones = repeat(ones, f"r{rep_node} -> {end_dims}", **repeats)
-    conditional = conditional * ones
+    rep_node = marginal_nodes_repeat[0]
+    cond_val = cond_vals[cond_nodes.index(rep_node)]
+
+    # === THE REPEATED NODE IS FIXED TO ITS CONDITIONING VALUE: ONLY THAT SLICE IS NONZERO
+    result = np.zeros([node2dims[node] for node in marginal_nodes])
+    rep_view = np.moveaxis(result, marginal_nodes.index(rep_node), -1)
+    if 0 <= cond_val < node2dims[rep_node]:
+        rep_view[..., cond_val] = conditional
     
-    return conditional
+    return result
 
 
 def add_repeated_nodes_conditional(
@@ -76,55 +67,63 @@ def add_repeated_nodes_conditional(
     node2dims: dict
 ):
     marginal_nodes_no_repeats = [node for node in marginal_nodes if node not in cond_nodes]
-    all_nodes = marginal_nodes_no_repeats + cond_nodes
     marginal_nodes_repeat = [node for node in marginal_nodes if node in cond_nodes]
-    
-    # === SET UP PATTERNS FOR START AND END DIMENSION
-    start_dims = " ".join([f"d{ix}" for ix in all_nodes])
-    end_dims = " ".join([
-        f"d{node}" if node in marginal_nodes_no_repeats else f"r{node}" 
-        for node in marginal_nodes
-    ])
-    end_dims += " " + " ".join([f"d{node}" for node in cond_nodes])
-    
-    # === FOR EACH MARGINAL NODE THAT'S IN THE CONDITIONING SET, REPEAT
-    pattern = start_dims + " -> " + end_dims
-    repeats = {f"r{node}": node2dims[node] for node in marginal_nodes_repeat}
-    conditional = repeat(conditional, pattern, **repeats)
 
-    ones = [np.eye(node2dims[node]) for node in marginal_nodes_repeat]
-    if len(ones) > 1:
+    if len(marginal_nodes_repeat) > 1:
         raise NotImplementedError
-    else:
-        ones = ones[0]
-        rep_node = marginal_nodes_repeat[0]
-        repeats = {f"d{node}": node2dims[node] for node in all_nodes if node != rep_node}
-        ones = repeat(ones, f"d{rep_node} r{rep_node} -> {end_dims}", **repeats)
-    conditional = conditional * ones
+    rep_node = marginal_nodes_repeat[0]
+    rep_dim = node2dims[rep_node]
+
+    # === ONLY THE DIAGONAL (MARGINAL VALUE == CONDITIONING VALUE) OF THE REPEATED NODE IS NONZERO,
+    # === SO WRITE THE CONDITIONAL ONTO THAT DIAGONAL INSTEAD OF MULTIPLYING BY A BROADCAST IDENTITY
+    result = np.zeros([node2dims[node] for node in marginal_nodes + cond_nodes])
+    marginal_axis = marginal_nodes.index(rep_node)
+    cond_axis = len(marginal_nodes) + cond_nodes.index(rep_node)
+    diagonal_view = np.moveaxis(result, [marginal_axis, cond_axis], [-2, -1])
+    input_axis = len(marginal_nodes_no_repeats) + cond_nodes.index(rep_node)
+    diagonal = np.arange(rep_dim)
+    diagonal_view[..., diagonal, diagonal] = np.moveaxis(conditional, input_axis, -1)
     
-    return conditional
+    return result
 
 
-def repeat_dimensions(
-    tensor, 
-    curr_dims, 
-    new_dims, 
-    dim_sizes, 
+def align_dimensions(
+    tensor,
+    curr_dims,
+    new_dims,
     add_new=True
 ):
-    start_dims = " ".join([f"d{ix}" for ix in curr_dims])
-    end_dims = " ".join([f"d{ix}" for ix in new_dims])
+    # === REORDER EXISTING AXES TO FOLLOW new_dims, THEN INSERT SINGLETON AXES
+    # === FOR MISSING DIMENSIONS. THE RESULT IS A VIEW THAT BROADCASTS AGAINST new_dims
+    axis_order = [curr_dims.index(d) for d in new_dims if d in curr_dims]
+    if add_new:
+        axis_order.append(len(curr_dims))
+    tensor = tensor.transpose(axis_order)
+
+    sizes = iter(tensor.shape)
+    shape = [next(sizes) if d in curr_dims else 1 for d in new_dims]
     if add_new:
-        start_dims += " d_new"
-        end_dims += " d_new"
-    repeat_pattern = start_dims + " -> " + end_dims
-    repeats = {f"d{ix}": dim_sizes[ix] for ix in new_dims if ix not in curr_dims}
-    new_tensor = repeat(tensor, repeat_pattern, **repeats)
-    return new_tensor
+        shape.append(next(sizes))
+    return tensor.reshape(shape)
+
+
+def repeat_dimensions(
+    tensor,
+    curr_dims,
+    new_dims,
+    dim_sizes,
+    add_new=True
+):
+    new_tensor = align_dimensions(tensor, curr_dims, new_dims, add_new=add_new)
+    if dim_sizes is None:
+        return new_tensor
+    shape = [dim_sizes[d] for d in new_dims] + list(new_tensor.shape[len(new_dims):])
+    return np.broadcast_to(new_tensor, shape)
 
 
 def extract_conditional(model, alphabets, node_alphabet):
-    vals = np.array(list(itr.product(*alphabets)))
+    grids = np.meshgrid(*(np.asarray(alphabet) for alphabet in alphabets), indexing="ij")
+    vals = np.stack([grid.ravel() for grid in grids], axis=1)
     probs = model.predict_proba(vals)
     
     nvals = probs.shape[1]
@@ -148,6 +147,15 @@ def indicator_conditional(input_alphabets, output_alphabet, value):
     return conditional
 
 
+def alphabet_indices(column: np.ndarray, vals):
+    # === POSITION OF EACH ENTRY OF column IN vals, AND WHETHER IT APPEARS THERE AT ALL
+    vals = np.asarray(vals)
+    order = np.argsort(vals, kind="stable")
+    sorted_vals = vals[order]
+    pos = np.minimum(np.searchsorted(sorted_vals, column), len(vals) - 1)
+    return order[pos], sorted_vals[pos] == column
+
+
 def get_conditional(
     data: np.ndarray, 
     node: int, 
@@ -157,45 +165,261 @@ def get_conditional(
     add_one=False,
     alpha: float = 1
 ):
+    nvals = len(vals)
+    val_ixs, in_alphabet = alphabet_indices(data[:, node], vals)
     if len(parent_ixs) == 0:
-        counts = np.array([np.sum(data[:, node] == val) for val in vals]).astype(float)
+        counts = np.bincount(val_ixs[in_alphabet], minlength=nvals).astype(float)
         if add_one:
             counts += alpha
         return counts / counts.sum()
     else:
-        nvals = len(vals)
-        conditional = np.ones(list(map(len, parent_alphabets)) + [nvals]) * 1/nvals
-        parent_vals_list = {tuple(parent_vals) for parent_vals in data[:, parent_ixs]}
-        for parent_vals in parent_vals_list:
-            ixs = (data[:, parent_ixs] == parent_vals).all(axis=1)
-            subdata = data[ixs, :]
-            if subdata.shape[0] > 0:
-                conditional[tuple(parent_vals)] = get_conditional(subdata, node, vals, [], [], add_one=add_one, alpha=alpha)
+        parent_dims = list(map(len, parent_alphabets))
+        conditional = np.ones(parent_dims + [nvals]) * 1/nvals
+
+        # === COUNT EACH (PARENT VALUES, NODE VALUE) COMBINATION WITH ONE bincount OVER FLAT CPT INDICES
+        parent_flat = np.ravel_multi_index(tuple(data[:, parent_ixs].T), parent_dims)
+        observed = np.bincount(parent_flat, minlength=prod(parent_dims)).reshape(parent_dims) > 0
+        flat = parent_flat[in_alphabet] * nvals + val_ixs[in_alphabet]
+        counts = np.bincount(flat, minlength=prod(parent_dims) * nvals).reshape(parent_dims + [nvals])
+        counts = counts.astype(float)
+
+        # === NORMALIZE ONLY THE OBSERVED PARENT VALUES, THE REST STAY UNIFORM
+        counts = counts[observed]
+        if add_one:
+            counts += alpha
+        conditional[observed] = counts / counts.sum(axis=-1, keepdims=True)
         return conditional
 
 
 def add_variable(
     table, 
     current_variables, 
-    conditional, 
+    log_conditional, 
     node2dims, 
     parents
 ):
-    log_conditional = no_warn_log(conditional)
-
-    log_conditional = repeat_dimensions(
+    # === NO NEED TO MATERIALIZE THE REPEATED CONDITIONAL, BROADCASTING HANDLES IT
+    log_conditional = align_dimensions(
         log_conditional,
         parents,
         current_variables,
-        node2dims,
     )
-    
+
     new_table = table.reshape(table.shape + (1, )) + log_conditional
     return new_table
 
 
 def marginalize(table, ixs):
-    return logsumexp(table, axis=tuple(ixs))
+    # === LOG-SUM-EXP WITH THE MAX PULLED OUT
+    axes = tuple(ixs)
+    table_max = np.max(table, axis=axes, keepdims=True)
+    table_max[np.isneginf(table_max)] = 0
+    tmp = np.subtract(table, table_max)
+    np.exp(tmp, out=tmp)
+    out = np.sum(tmp, axis=axes, keepdims=True)
+    with np.errstate(divide="ignore"):
+        np.log(out, out=out)
+    out += table_max
+    return np.squeeze(out, axis=axes)
+
+
+def add_and_marginalize(
+    table,
+    current_variables,
+    conditional,
+    parents,
+    ixs,
+    tmp=None
+):
+    # === SAME RESULT AS marginalize(add_variable(...), ixs), WITHOUT BUILDING THE JOINT TABLE:
+    # === PULL THE MAX OUT OF THE LOG TABLE, THEN SUM OUT THE AXES WITH A SINGLE CONTRACTION
+    table_max = np.max(table, axis=tuple(ixs), keepdims=True)
+    table_max[np.isneginf(table_max)] = 0
+    probs = np.subtract(table, table_max, out=tmp)
+    np.exp(probs, out=probs)
+
+    symbols = [oe.get_symbol(ix) for ix in range(len(current_variables) + 1)]
+    var2symbol = dict(zip(current_variables, symbols))
+    table_pattern = "".join(symbols[:-1])
+    conditional_pattern = "".join(var2symbol[p] for p in parents) + symbols[-1]
+    output_pattern = "".join(s for ix, s in enumerate(symbols[:-1]) if ix not in ixs) + symbols[-1]
+    new_table = oe.contract(f"{table_pattern},{conditional_pattern}->{output_pattern}", probs, conditional)
+
+    table_max = np.squeeze(table_max, axis=tuple(ixs))
+    with np.errstate(divide="ignore"):
+        return np.log(new_table) + table_max[..., None]
+
+
+@lru_cache(maxsize=1024)
+def get_contract_expression(pattern, *shapes):
+    # === PATTERNS USE SYMBOLS IN ORDER OF APPEARANCE, SO STRUCTURALLY IDENTICAL
+    # === CONTRACTIONS SHARE ONE COMPILED EXPRESSION
+    return oe.contract_expression(pattern, *shapes, optimize="dp")
+
+
+@njit(parallel=True, cache=True)
+def _inverse_cdf(dists, unifs):
+    nsamples, nvals = dists.shape
+    vals = np.zeros(nsamples, dtype=np.int64)
+    for i in prange(nsamples):
+        acc = 0.0
+        for v in range(nvals - 1):
+            acc += dists[i, v]
+            vals[i] += acc <= unifs[i]
+    return vals
+
+
+@njit(parallel=True, cache=True)
+def _sample_kernel(
+    samples,
+    order,
+    offsets,
+    nvals,
+    parent_ptr,
+    parent_cols,
+    parent_strides,
+    flat_cpts,
+    unifs
+):
+    nsamples = samples.shape[0]
+    for i in prange(nsamples):
+        for k in range(order.shape[0]):
+            node_ix = order[k]
+
+            # === LOCATE THE ROW OF THE CPT SELECTED BY THE PARENT VALUES
+            row = offsets[node_ix]
+            for j in range(parent_ptr[node_ix], parent_ptr[node_ix+1]):
+                row += samples[i, parent_cols[j]] * parent_strides[j]
+
+            # === INVERSE CDF: COUNT HOW MANY PARTIAL SUMS ARE BELOW THE UNIFORM
+            u = unifs[i, k]
+            acc = 0.0
+            val = 0
+            for v in range(nvals[node_ix] - 1):
+                acc += flat_cpts[row + v]
+                val += acc <= u
+            samples[i, node_ix] = val
+
+
+@njit(parallel=True, cache=True)
+def _eif_kernel(
+    samples,
+    means_flat,
+    offsets,
+    cs_cols,
+    cs_strides,
+    const,
+    out
+):
+    nsamples = samples.shape[0]
+    nsets, rank = cs_cols.shape
+    for s in prange(nsamples):
+        total = const
+        for i in range(nsets):
+            # === FLAT POSITION OF THIS SAMPLE'S CONDITIONING VALUES IN THE i-TH MEAN TABLE;
+            # === PADDED ENTRIES HAVE STRIDE ZERO, SO EVERY SET RUNS THE SAME FIXED-LENGTH LOOP
+            ix = offsets[i]
+            for j in range(rank):
+                ix += cs_strides[i, j] * samples[s, cs_cols[i, j]]
+            total += means_flat[ix]
+        out[s] = total
+
+
+def pack_conditional_means(conds2counts, conds2means, dtype=np.float64):
+    # === STRUCTURE-OF-ARRAYS LAYOUT FOR _eif_kernel: ALL MEAN TABLES IN ONE FLAT BUFFER, AND
+    # === THE COLUMNS/STRIDES OF EACH CONDITIONING SET PADDED TO A COMMON RANK
+    rank = max((len(cond_set) for cond_set in conds2means), default=0)
+    nsets = len(conds2means)
+    means, offsets, counts = [], [], []
+    cs_cols = np.zeros((nsets, rank), dtype=np.int64)
+    cs_strides = np.zeros((nsets, rank), dtype=np.int64)
+    size = 0
+    for i, (cond_set, conditional_mean) in enumerate(conds2means.items()):
+        conditional_mean = np.array(conditional_mean, dtype=dtype, order="C")
+        means.append(conditional_mean.ravel())
+        offsets.append(size)
+        counts.append(conds2counts[cond_set])
+        cs_cols[i, :len(cond_set)] = list(cond_set)
+        cs_strides[i, :len(cond_set)] = [stride // conditional_mean.itemsize for stride in conditional_mean.strides]
+        size += conditional_mean.size
+
+    return (
+        np.concatenate(means) if means else np.zeros(0, dtype=dtype),
+        np.array(offsets, dtype=np.int64),
+        cs_cols,
+        cs_strides,
+        np.array(counts, dtype=dtype)
+    )
+
+
+def build_efficient_influence_function(
+    conds2counts, 
+    conds2means, 
+    propensity, 
+    dtype=np.float64, 
+    conds2observed=None
+):
+    if not propensity > 0:
+        raise ValueError(f"propensity must be positive, got {propensity}")
+    
+    # === EVERYTHING EXCEPT THE SAMPLES IS FIXED HERE: TERMS WITH AN EMPTY CONDITIONING SET
+    # === FOLD INTO ONE CONSTANT, AND EACH REMAINING MEAN TABLE IS PRE-SCALED BY ITS COUNT OVER
+    # === THE PROPENSITY, SO THE KERNEL ONLY GATHERS AND ADDS
+    const = sum(
+        conds2counts[cond_set] * float(conditional_mean) 
+        for cond_set, conditional_mean in conds2means.items() if len(cond_set) == 0
+    ) / propensity
+    conds2means = {cond_set: mean for cond_set, mean in conds2means.items() if len(cond_set) > 0}
+    means_flat, offsets, cs_cols, cs_strides, counts = pack_conditional_means(conds2counts, conds2means, dtype=dtype)
+    table_sizes = np.diff(np.append(offsets, means_flat.size))
+    means_flat *= np.repeat(counts / propensity, table_sizes)
+    
+    # === THE KERNEL DOES NO BOUNDS CHECKING, SO EVERY GATHERED COLUMN IS VALIDATED UP FRONT
+    col2dim = {
+        col: dim 
+        for cond_set, conditional_mean in conds2means.items() 
+        for col, dim in zip(cond_set, np.shape(conditional_mean))
+    }
+    check_cols = np.array(list(col2dim.keys()), dtype=np.int64)
+    check_dims = np.array(list(col2dim.values()), dtype=np.int64)
+    # === PARTIAL TABLES ONLY HAVE ESTIMATES AT THE OBSERVED CONDITIONING VALUES (conds2observed);
+    # === THE MISSING CELLS ARE PACKED LIKE THE MEANS, SO THE SAME KERNEL COUNTS HITS PER SAMPLE
+    missing_flat = None
+    if conds2observed:
+        conds2missing = {
+            cond_set: (
+                ~conds2observed[cond_set] if cond_set in conds2observed 
+                else np.zeros(np.shape(conditional_mean), dtype=bool)
+            )
+            for cond_set, conditional_mean in conds2means.items()
+        }
+        missing_flat = pack_conditional_means(conds2counts, conds2missing)[0]
+        if not missing_flat.any():
+            missing_flat = None
+    
+    def efficient_influence_function(samples, out=None):
+        used = samples[:, check_cols]
+        if ((used < 0) | (used >= check_dims)).any():
+            raise IndexError("Sample values must lie in the alphabet of their node")
+        samples = np.ascontiguousarray(samples)
+        if missing_flat is not None:
+            hits = np.empty(samples.shape[0])
+            _eif_kernel(samples, missing_flat, offsets, cs_cols, cs_strides, 0.0, hits)
+            if (hits > 0).any():
+                missing = np.flatnonzero(hits > 0)
+                raise KeyError(f"No conditional mean for the conditioning values of samples {missing.tolist()}")
+        # === THE KERNEL OVERWRITES EVERY ENTRY, SO A CALLER-PROVIDED out CAN BE REUSED ACROSS
+        # === CALLS (E.G. IN BOOTSTRAP LOOPS) AND A FRESH BUFFER NEED NOT BE ZEROED
+        if out is None:
+            out = np.empty(samples.shape[0], dtype=dtype)
+        elif out.ndim != 1 or out.shape[0] != samples.shape[0]:
+            raise ValueError(f"out must have shape ({samples.shape[0]},), got {out.shape}")
+        elif out.dtype != dtype:
+            raise ValueError(f"out must have dtype {np.dtype(dtype)}, got {out.dtype}")
+        _eif_kernel(samples, means_flat, offsets, cs_cols, cs_strides, const, out)
+        return out
+
+    return efficient_influence_function
 
 
 class DiscreteDAG(FunctionalDAG):
@@ -205,9 +429,13 @@ class DiscreteDAG(FunctionalDAG):
         arcs, 
         conditionals: Dict[Hashable, np.ndarray], 
         node2parents: Dict[Hashable, List],
-        node_alphabets: Dict[Hashable, List]
+        node_alphabets: Dict[Hashable, List],
+        dtype=None
     ):
         super().__init__(set(nodes), arcs)
+        if dtype is not None and conditionals is not None:
+            conditionals = {node: np.ascontiguousarray(cpt, dtype=dtype) for node, cpt in conditionals.items()}
+        self.dtype = dtype
         self.conditionals = conditionals
         self.node2parents = node2parents
         self.node_alphabets = node_alphabets
@@ -215,41 +443,170 @@ class DiscreteDAG(FunctionalDAG):
             node: len(alphabet) 
             for node, alphabet in self.node_alphabets.items()
         }
+        self._alphabet_arr = {node: np.asarray(alphabet) for node, alphabet in self.node_alphabets.items()}
         self._node_list = list(nodes)
         self._node2ix = core_utils.ix_map_from_list(self._node_list)
+        self._contract_cache = dict()
+        self._marginal_plan_cache = dict()
+        self._flat_conditionals = None
+        self._cupy_conditionals = None
+        self._vecache = dict()
+        self._imset_cache = dict()
         
         for node, parents in node2parents.items():
             expected_shape = tuple([len(node_alphabets[p]) for p in parents + [node]])
             if conditionals is not None:
                 assert conditionals[node].shape == expected_shape
         
+        # === LOG CPTS ARE REUSED BY EVERY ELIMINATION, SO COMPUTE THEM ONCE
+        self._log_conditionals = None
+        if conditionals is not None:
+            self._log_conditionals = {node: no_warn_log(cpt) for node, cpt in conditionals.items()}
+
+        self._build_structure_arrays()
+
+    def _build_structure_arrays(self):
+        # === FROZEN ARRAY VIEW OF THE STRUCTURE, INDEXED BY COLUMN IN _node_list
+        self._topo_order = np.array([self._node2ix[node] for node in self.topological_sort()], dtype=np.int64)
+        parent_cols, parent_strides, parent_ptr = [], [], [0]
+        cpt_sizes = []
+        for node in self._node_list:
+            parents = self.node2parents[node]
+            shape = [self.node2dims[p] for p in parents] + [self.node2dims[node]]
+            parent_cols.extend(self._node2ix[p] for p in parents)
+            parent_strides.extend(prod(shape[ix+1:]) for ix in range(len(parents)))
+            parent_ptr.append(len(parent_cols))
+            cpt_sizes.append(prod(shape))
+        self._parents_ptr = np.array(parent_ptr, dtype=np.int64)
+        self._parents_idx = np.array(parent_cols, dtype=np.int64)
+        self._parent_strides = np.array(parent_strides, dtype=np.int64)
+        self._cpt_offsets = np.concatenate(([0], np.cumsum(cpt_sizes)[:-1])).astype(np.int64)
+        self._nvals = np.array([self.node2dims[node] for node in self._node_list], dtype=np.int64)
+        
+    def _shallow_clone(self, arcs=None, conditionals=None, node2parents=None):
+        # === THE CLONE SHARES CPT ARRAYS, ALPHABETS AND ALL DERIVED STATE THAT AN OVERRIDE DOES
+        # === NOT TOUCH, BUT HAS ITS OWN CONTAINERS, SO REPLACING A CONDITIONAL OR PARENT LIST
+        # === DOES NOT AFFECT THIS DAG
+        clone = DiscreteDAG.__new__(DiscreteDAG)
+        if arcs is None:
+            DAG.__init__(clone, dag=self)
+        else:
+            DAG.__init__(clone, set(self._node_list), arcs)
+        
+        clone.dtype = self.dtype
+        if conditionals is None:
+            clone.conditionals = dict(self.conditionals)
+        elif self.dtype is not None:
+            clone.conditionals = {node: np.ascontiguousarray(cpt, dtype=self.dtype) for node, cpt in conditionals.items()}
+        else:
+            clone.conditionals = conditionals
+        if node2parents is None:
+            node2parents = {node: list(parents) for node, parents in self.node2parents.items()}
+        clone.node2parents = node2parents
+        clone.node_alphabets = self.node_alphabets
+        clone.node2dims = self.node2dims
+        clone._alphabet_arr = self._alphabet_arr
+        clone._node_list = list(self._node_list)
+        clone._node2ix = self._node2ix
+        
+        # === LOG CPTS ARE ONLY RECOMPUTED FOR CONDITIONALS THAT WERE ACTUALLY REPLACED
+        clone._log_conditionals = {
+            node: self._log_conditionals[node] if cpt is self.conditionals[node] else no_warn_log(cpt)
+            for node, cpt in clone.conditionals.items()
+        }
+        for node, parents in clone.node2parents.items():
+            expected_shape = tuple([clone.node2dims[p] for p in parents + [node]])
+            assert clone.conditionals[node].shape == expected_shape
+        
+        # === CACHES THAT ONLY DEPEND ON THE CPT VALUES
+        if conditionals is None:
+            clone._flat_conditionals = self._flat_conditionals
+            clone._cupy_conditionals = self._cupy_conditionals
+            clone._vecache = dict(self._vecache)
+        else:
+            clone._flat_conditionals = None
+            clone._cupy_conditionals = None
+            clone._vecache = dict()
+        
+        # === CACHES AND ARRAYS THAT ONLY DEPEND ON THE STRUCTURE (AND HENCE THE CPT SHAPES)
+        if arcs is None and node2parents is None:
+            clone._contract_cache = dict(self._contract_cache)
+            clone._marginal_plan_cache = dict(self._marginal_plan_cache)
+            clone._imset_cache = dict(self._imset_cache)
+            clone._topo_order = self._topo_order
+            clone._parents_ptr = self._parents_ptr
+            clone._parents_idx = self._parents_idx
+            clone._parent_strides = self._parent_strides
+            clone._cpt_offsets = self._cpt_offsets
+            clone._nvals = self._nvals
+        else:
+            clone._contract_cache = dict()
+            clone._marginal_plan_cache = dict()
+            clone._imset_cache = dict()
+            clone._build_structure_arrays()
+        return clone
+
     def copy(self):
-        return deepcopy(self)
+        return self._shallow_clone()
 
     def set_conditional(self, node, cpt):
+        if self.dtype is not None:
+            cpt = np.ascontiguousarray(cpt, dtype=self.dtype)
         self.conditionals[node] = cpt
+        self._log_conditionals[node] = no_warn_log(cpt)
+        self._flat_conditionals = None
+        self._cupy_conditionals = None
+        self._vecache = dict()
+
+    def _get_flat_conditionals(self):
+        # === ALL CPTS IN ONE BUFFER, LAID OUT ACCORDING TO self._cpt_offsets
+        if self._flat_conditionals is None:
+            self._flat_conditionals = np.concatenate([
+                np.ascontiguousarray(self.conditionals[node], dtype=np.float64).ravel()
+                for node in self._node_list
+            ])
+        return self._flat_conditionals
 
     def sample(self, nsamples: int = 1, progress=False) -> np.array:
         samples = np.zeros((nsamples, len(self._nodes)), dtype=int)
-        t = self.topological_sort()
-        t = t if not progress else tqdm(t)
+        has_parents = self._parents_ptr[1:] != self._parents_ptr[:-1]
+        roots = self._topo_order[~has_parents[self._topo_order]]
+        order = self._topo_order[has_parents[self._topo_order]]
+
+        for node_ix in roots:
+            node = self._node_list[node_ix]
+            samples[:, node_ix] = np.random.choice(
+                self.node_alphabets[node], 
+                p=self.conditionals[node], 
+                size=nsamples
+            )
 
-        for node in t:
-            parents = self.node2parents[node]
-            if len(parents) == 0:
-                vals = np.random.choice(
-                    self.node_alphabets[node], 
-                    p=self.conditionals[node], 
-                    size=nsamples
-                )
-            else:
-                parent_ixs = [self._node2ix[p] for p in parents]
-                parent_vals = samples[:, parent_ixs]
-                dists = self.conditionals[node][tuple(parent_vals.T)]
-                unifs = np.random.random(size=nsamples)
-                dist_sums = np.cumsum(dists, axis=1)
-                vals = np.argmax(dist_sums > unifs[:, None], axis=1)
-            samples[:, self._node2ix[node]] = vals
+        # === THE KERNEL INDEXES CPTS BY PARENT VALUES WITHOUT BOUNDS CHECKS, SO ROOTS THAT ARE
+        # === PARENTS MUST HAVE DRAWN VALID INDICES (I.E. THEIR ALPHABET IS range(k))
+        parent_roots = roots[np.isin(roots, self._parents_idx)]
+        root_vals = samples[:, parent_roots]
+        if ((root_vals < 0) | (root_vals >= self._nvals[parent_roots])).any():
+            raise IndexError("Values of a parent node must index its alphabet")
+
+        unifs = np.random.random(size=(nsamples, len(order)))
+        flat_conditionals = self._get_flat_conditionals()
+        # === WITH A PROGRESS BAR, RUN THE KERNEL OVER BLOCKS OF ROWS SO THE BAR TRACKS THE REAL WORK
+        blocks = [(0, nsamples)]
+        if progress:
+            bounds = np.linspace(0, nsamples, min(nsamples, 100) + 1).astype(int)
+            blocks = tqdm(list(zip(bounds[:-1], bounds[1:])))
+        for start, end in blocks:
+            _sample_kernel(
+                samples[start:end],
+                order,
+                self._cpt_offsets,
+                self._nvals,
+                self._parents_ptr,
+                self._parents_idx,
+                self._parent_strides,
+                flat_conditionals,
+                unifs[start:end]
+            )
 
         return samples
     
@@ -259,7 +616,7 @@ class DiscreteDAG(FunctionalDAG):
         samples[:, nodes] = values
         weights = np.zeros((nsamples, len(nodes)))
         
-        t = self.topological_sort()
+        t = [self._node_list[ix] for ix in self._topo_order]
         t = t if not progress else tqdm(t)
 
         for node in t:
@@ -276,8 +633,7 @@ class DiscreteDAG(FunctionalDAG):
                     parent_vals = samples[:, parent_ixs]
                     dists = self.conditionals[node][tuple(parent_vals.T)]
                     unifs = np.random.random(size=nsamples)
-                    dist_sums = np.cumsum(dists, axis=1)
-                    vals = np.argmax(dist_sums > unifs[:, None], axis=1)
+                    vals = _inverse_cdf(dists, unifs)
                 samples[:, self._node2ix[node]] = vals
             else:
                 parents = self.node2parents[node]
@@ -297,7 +653,7 @@ class DiscreteDAG(FunctionalDAG):
     def sample_interventional(self, nodes2intervention_values):
         nsamples = list(nodes2intervention_values.values())[0].shape[0]
         samples = np.zeros((nsamples, self.nnodes), dtype=int)
-        t = self.topological_sort()
+        t = [self._node_list[ix] for ix in self._topo_order]
 
         for node in t:
             parents = self.node2parents[node]
@@ -314,8 +670,9 @@ class DiscreteDAG(FunctionalDAG):
                 else:
                     parent_ixs = [self._node2ix[p] for p in parents]
                     parent_vals = samples[:, parent_ixs]
-                    dists = [self.conditionals[node][tuple(v)] for v in parent_vals]
-                    vals = [np.random.choice(self.node_alphabets[node], p=d) for d in dists]
+                    dists = self.conditionals[node][tuple(parent_vals.T)]
+                    unifs = np.random.random(size=nsamples)
+                    vals = np.asarray(self.node_alphabets[node])[_inverse_cdf(dists, unifs)]
                 samples[:, node_ix] = vals
 
         return samples
@@ -325,6 +682,17 @@ class DiscreteDAG(FunctionalDAG):
     
     def predict_from_parents(self, node, parent_vals):
         conditional = self.conditionals[node]
+
+        # === FAST PATHS FOR FEW PARENTS: INDEX WITH COLUMNS DIRECTLY, NO TUPLE OF ROWS
+        if parent_vals.ndim == 2:
+            nparents = parent_vals.shape[1]
+            if nparents == 1:
+                return conditional[parent_vals[:, 0]]
+            elif nparents == 2:
+                return conditional[parent_vals[:, 0], parent_vals[:, 1]]
+            elif nparents == 3:
+                return conditional[parent_vals[:, 0], parent_vals[:, 1], parent_vals[:, 2]]
+
         ixs = tuple(parent_vals.T)
         return conditional[ixs]
         
@@ -336,16 +704,14 @@ class DiscreteDAG(FunctionalDAG):
             node: self.conditionals[node] if node != target_node else target_conditional
             for node in self.nodes  
         }
-        new_node2parents = deepcopy(self.node2parents)
+        new_node2parents = {node: list(parents) for node, parents in self.node2parents.items()}
         new_node2parents[target_node] = []
         new_arcs = {(i, j) for i, j in self.arcs if j != target_node}
         
-        return DiscreteDAG(
-            nodes=self.nodes,
+        return self._shallow_clone(
             arcs=new_arcs,
             conditionals=new_conditionals,
-            node2parents=new_node2parents,
-            node_alphabets=self.node_alphabets
+            node2parents=new_node2parents
         )
         
     def _get_marginal_dag_node(self, marginalized_node, relabel=False):
@@ -353,14 +719,13 @@ class DiscreteDAG(FunctionalDAG):
         m_children = self.children_of(marginalized_node)
         m_parents = self.node2parents[marginalized_node]
         m_conditional = self.conditionals[marginalized_node]
-        m_shape = " ".join([f"d{i}" for i in m_parents + [marginalized_node]])
         
         # === SPECIFY NEW PARENT SETS AND CORRESPONDING ARCS
         new_arcs = {
             (i, j) for i, j in self.arcs 
             if j != marginalized_node and i != marginalized_node
         }
-        new_node2parents = deepcopy(self.node2parents)
+        new_node2parents = {node: list(parents) for node, parents in self.node2parents.items()}
         del new_node2parents[marginalized_node]
         for m_child in m_children:
             new_parents = [p for p in self.node2parents[m_child] if p != marginalized_node]
@@ -378,10 +743,20 @@ class DiscreteDAG(FunctionalDAG):
             child_conditional = self.conditionals[m_child]
             
             # === COMPUTE NEW CONDITIONAL FROM OLD
-            child_shape = " ".join([f"d{i}" for i in self.node2parents[m_child] + [m_child]])
-            output_shape = " ".join([f"d{i}" for i in new_node2parents[m_child] + [m_child]])
-            pattern = f"{child_shape}, {m_shape} -> {output_shape}"
-            new_conditional = einsum(child_conditional, m_conditional, pattern)
+            child_nodes = self.node2parents[m_child] + [m_child]
+            m_nodes = m_parents + [marginalized_node]
+            node2symbol = dict()
+            for node in child_nodes + m_nodes:
+                node2symbol.setdefault(node, oe.get_symbol(len(node2symbol)))
+            child_pattern = "".join(node2symbol[i] for i in child_nodes)
+            m_pattern = "".join(node2symbol[i] for i in m_nodes)
+            output_pattern = "".join(node2symbol[i] for i in new_node2parents[m_child] + [m_child])
+            expr = get_contract_expression(
+                f"{child_pattern},{m_pattern}->{output_pattern}",
+                child_conditional.shape,
+                m_conditional.shape
+            )
+            new_conditional = expr(child_conditional, m_conditional)
             # the line below is only needed for numerical stability
             new_conditional = new_conditional / new_conditional.sum(axis=-1, keepdims=True)
             new_conditionals[m_child] = new_conditional
@@ -402,13 +777,14 @@ class DiscreteDAG(FunctionalDAG):
             arcs=new_arcs,
             conditionals=new_conditionals,
             node2parents=new_node2parents,
-            node_alphabets=new_alphabets
+            node_alphabets=new_alphabets,
+            dtype=self.dtype
         )
         
         return new_ddag, labels
         
     def get_marginal_dag(self, marginalized_nodes, relabel=False):
-        new_dag = self.copy()
+        new_dag = self._shallow_clone()
         relabeling_function = {node: node for node in self.nodes}
         nodes2marginalize = list(marginalized_nodes)
         while len(nodes2marginalize) > 0:
@@ -422,76 +798,113 @@ class DiscreteDAG(FunctionalDAG):
             }
         return new_dag, relabeling_function
         
-    def get_marginals_new(self, marginal_nodes: List[Hashable], log=False):
+    def _get_marginals_expression(self, marginal_nodes: List[Hashable]):
+        key = tuple(marginal_nodes)
+        if key not in self._contract_cache:
+            ancestor_subgraph = self.ancestral_subgraph(set(marginal_nodes))
+            topsort = ancestor_subgraph.topological_sort()
+            node2symbol = {node: oe.get_symbol(ix) for ix, node in enumerate(topsort)}
+
+            # === ONE FACTOR PER CONDITIONAL, INDEXED BY (PARENTS..., NODE)
+            input_patterns = [
+                "".join(node2symbol[p] for p in self.node2parents[node] + [node])
+                for node in topsort
+            ]
+            output_pattern = "".join(node2symbol[node] for node in marginal_nodes)
+            pattern = ",".join(input_patterns) + "->" + output_pattern
+            shapes = [self.conditionals[node].shape for node in topsort]
+            expr = oe.contract_expression(pattern, *shapes, optimize="auto")
+            self._contract_cache[key] = (topsort, expr)
+
+        return self._contract_cache[key]
+
+    def get_marginals_new(self, marginal_nodes: List[Hashable], log=False, backend="numpy"):
         if len(marginal_nodes) == 0:
             return 1
-        ancestor_subgraph = self.ancestral_subgraph(set(marginal_nodes))
-        elimination_ordering = ancestor_subgraph.topological_sort()
-        node0 = elimination_ordering[0]
-        current_nodes = [node0]
-        log_table = np.log(self.conditionals[node0])
-        
-        for elim_node in elimination_ordering:
-            # === ADD FACTORS INVOLVING THIS NODE
-            new_children = list(ancestor_subgraph.children_of(elim_node) - set(current_nodes))
-            
-            for child in new_children:
-                remaining_parents = [p for p in self.node2parents[child] if p in current_nodes]
-                log_table = add_variable(
-                    log_table,
-                    current_nodes,
-                    self.conditionals[child],
-                    self.node2dims,
-                    remaining_parents,
-                )
-                current_nodes.append(child)
-                
-            # === ELIMINATE THE CURRENT NODE
-            if elim_node not in marginal_nodes:
-                ix = current_nodes.index(elim_node)
-                log_table = marginalize(log_table, [ix])
-                current_nodes = [node for node in current_nodes if node != elim_node]
-            
-        if not log:
-            table = np.exp(log_table)
+        if backend not in {"numpy", "cuquantum"}:
+            raise ValueError(f"Unknown backend {backend}")
+        topsort, expr = self._get_marginals_expression(marginal_nodes)
+
+        # === ONLY WORTH MOVING TO THE GPU IF THE NETWORK IS LARGE ENOUGH TO AMORTIZE THE TRANSFER
+        log_size = sum(np.log(self.node2dims[node]) for node in topsort)
+        if backend == "cuquantum" and log_size > CUQUANTUM_LOG_SIZE_THRESHOLD:
+            import cupy as cp
+            from cuquantum.tensornet import contract
+
+            cupy_conditionals = self.to_cupy()
+            operands = [cupy_conditionals[node] for node in topsort]
+            table = contract(expr.contraction, *operands, optimize={"samples": 16})
+            table = cp.asnumpy(table)
         else:
-            table = log_table
-        
-        return repeat_dimensions(table, current_nodes, marginal_nodes, None, add_new=False)
-
-    def get_marginals(self, marginal_nodes: List[Hashable], log=False):
-        ancestor_subgraph = self.ancestral_subgraph(set(marginal_nodes))
-        t = ancestor_subgraph.topological_sort()
+            table = expr(*(self.conditionals[node] for node in topsort), backend="numpy")
+            # === A TRIVIAL CONTRACTION (E.G. THE MARGINAL OF A ROOT) RETURNS A VIEW OF A CPT
+            if any(np.may_share_memory(table, self.conditionals[node]) for node in topsort):
+                table = table.copy()
 
-        current_nodes = [t[0]]
-        added_nodes = {t[0]}
-        log_table = np.log(self.conditionals[t[0]])
-        
-        for new_node in t[1:]:
-            node2ix = {node: ix for ix, node in enumerate(current_nodes)}
-
-            log_table = add_variable(
-                log_table, 
-                current_nodes,
-                self.conditionals[new_node], 
-                self.node2dims, 
-                self.node2parents[new_node]
-            )
-            current_nodes.append(new_node)
-            added_nodes.add(new_node)
-
-            # === MARGINALIZE ANY NODE WHERE ALL CHILDREN HAVE BEEN ADDED
-            marginalizable_nodes = {
-                node for node in current_nodes 
-                if (ancestor_subgraph.children_of(node) <= added_nodes)
-                and (node not in marginal_nodes)
-            }
-            if len(marginalizable_nodes) > 0:
-                log_table = marginalize(log_table, [node2ix[node] for node in marginalizable_nodes])
+        if not log:
+            return table
+        with np.errstate(divide="ignore"):
+            return np.log(table)
+
+    def _get_elimination_plan(self, marginal_nodes: List[Hashable]):
+        key = frozenset(marginal_nodes)
+        if key not in self._marginal_plan_cache:
+            ancestor_subgraph = self.ancestral_subgraph(set(marginal_nodes))
+            t = ancestor_subgraph.topological_sort()
+
+            current_nodes = [t[0]]
+            added_nodes = {t[0]}
+            steps = []
+            scratch_size = 0
+            for new_node in t[1:]:
+                node2ix = {node: ix for ix, node in enumerate(current_nodes)}
+                step_nodes = list(current_nodes)
+                current_nodes.append(new_node)
+                added_nodes.add(new_node)
+
+                # === MARGINALIZE ANY NODE WHERE ALL CHILDREN HAVE BEEN ADDED
+                marginalizable_nodes = {
+                    node for node in current_nodes 
+                    if (ancestor_subgraph.children_of(node) <= added_nodes)
+                    and (node not in key)
+                }
+                ixs = [node2ix[node] for node in marginalizable_nodes]
+                steps.append((new_node, step_nodes, marginalizable_nodes, ixs))
+                if len(ixs) > 0:
+                    scratch_size = max(scratch_size, prod(self.node2dims[node] for node in step_nodes))
                 current_nodes = [
                     node for node in current_nodes
                     if node not in marginalizable_nodes
                 ]
+            self._marginal_plan_cache[key] = (t[0], steps, current_nodes, scratch_size)
+
+        return self._marginal_plan_cache[key]
+
+    def get_marginals(self, marginal_nodes: List[Hashable], log=False):
+        node0, steps, current_nodes, scratch_size = self._get_elimination_plan(marginal_nodes)
+        log_table = self._log_conditionals[node0].copy()
+
+        # === ONE SCRATCH BUFFER, SIZED TO THE LARGEST TABLE THAT GETS MARGINALIZED, SERVES EVERY STEP
+        scratch = np.empty(scratch_size, dtype=log_table.dtype)
+        
+        for new_node, step_nodes, _, ixs in steps:
+            if len(ixs) > 0:
+                log_table = add_and_marginalize(
+                    log_table,
+                    step_nodes,
+                    self.conditionals[new_node],
+                    self.node2parents[new_node],
+                    ixs,
+                    tmp=scratch[:log_table.size].reshape(log_table.shape)
+                )
+            else:
+                log_table = add_variable(
+                    log_table, 
+                    step_nodes,
+                    self._log_conditionals[new_node], 
+                    self.node2dims, 
+                    self.node2parents[new_node]
+                )
         
         if not log:
             table = np.exp(log_table)
@@ -500,41 +913,32 @@ class DiscreteDAG(FunctionalDAG):
         return repeat_dimensions(table, current_nodes, marginal_nodes, None, add_new=False)
 
     def get_marginal(self, node, verbose=False, log=False):
-        ancestor_subgraph = self.ancestral_subgraph(node)
-        t = ancestor_subgraph.topological_sort()
-        if verbose: print(f"Ancestor subgraph: {ancestor_subgraph}")
+        node0, steps, _, scratch_size = self._get_elimination_plan([node])
+        if verbose: print(f"Ancestor subgraph: {self.ancestral_subgraph(node)}")
 
-        current_nodes = [t[0]]
-        added_nodes = {t[0]}
-        table = no_warn_log(self.conditionals[t[0]])
+        table = self._log_conditionals[node0]
+        scratch = np.empty(scratch_size, dtype=table.dtype)
         
-        for new_node in t[1:]:
-            node2ix = {node: ix for ix, node in enumerate(current_nodes)}
-
-            if verbose: print(f"====== Adding {new_node} to {current_nodes} ======")
-            table = add_variable(
-                table, 
-                current_nodes,
-                self.conditionals[new_node], 
-                self.node2dims, 
-                self.node2parents[new_node]
-            )
-            current_nodes.append(new_node)
-            added_nodes.add(new_node)
-
-            # === MARGINALIZE ANY NODE WHERE ALL CHILDREN HAVE BEEN ADDED
-            marginalizable_nodes = {
-                node for node in current_nodes 
-                if (ancestor_subgraph.children_of(node) <= added_nodes)
-                and (node != new_node)
-            }
+        for new_node, step_nodes, marginalizable_nodes, ixs in steps:
+            if verbose: print(f"====== Adding {new_node} to {step_nodes} ======")
             if verbose: print(f"Marginalizing {marginalizable_nodes}")
-            if len(marginalizable_nodes) > 0:
-                table = marginalize(table, [node2ix[node] for node in marginalizable_nodes])
-                current_nodes = [
-                    node for node in current_nodes
-                    if node not in marginalizable_nodes
-                ]
+            if len(ixs) > 0:
+                table = add_and_marginalize(
+                    table,
+                    step_nodes,
+                    self.conditionals[new_node],
+                    self.node2parents[new_node],
+                    ixs,
+                    tmp=scratch[:table.size].reshape(table.shape)
+                )
+            else:
+                table = add_variable(
+                    table, 
+                    step_nodes,
+                    self._log_conditionals[new_node], 
+                    self.node2dims, 
+                    self.node2parents[new_node]
+                )
             
             if verbose: print(f"Shape: {table.shape}")
                 
@@ -644,16 +1048,15 @@ class DiscreteDAG(FunctionalDAG):
         conds2condtionals = dict()
         conds2marginals = dict()
         shape = [len(self.node_alphabets[node]) for node in marginal_nodes]
-        possible_marginal_vals = list(itr.product(*(self.node_alphabets[node] for node in marginal_nodes)))
         for ix, cond_val in enumerate(cond_values):
             start_ix, end_ix = nparticles * ix, nparticles * (ix + 1)
             subset_weights = prod_weights[start_ix:end_ix]
             subset_samples = samples[start_ix:end_ix, marginal_nodes]
             
-            conditional_unnorm = np.zeros(shape)
-            for marginal_node_vals in possible_marginal_vals:
-                ixs = np.where((subset_samples == marginal_node_vals).all(axis=1))[0]
-                conditional_unnorm[marginal_node_vals] = np.sum(subset_weights[ixs])
+            # === ACCUMULATE THE WEIGHT OF EACH SAMPLE INTO ITS CELL IN ONE PASS
+            flat_ixs = np.ravel_multi_index(tuple(subset_samples.T), shape)
+            conditional_unnorm = np.bincount(flat_ixs, weights=subset_weights, minlength=prod(shape))
+            conditional_unnorm = conditional_unnorm.reshape(shape)
             conditional = conditional_unnorm / np.sum(conditional_unnorm)
             
             conds2condtionals[cond_val] = conditional
@@ -676,39 +1079,19 @@ class DiscreteDAG(FunctionalDAG):
         cond_log_marginal = marginalize(full_log_marginal, list(range(len(marginal_nodes_no_repeats))))
         cond_log_marginal_rs = cond_log_marginal.reshape((1, ) * len(marginal_nodes_no_repeats) + cond_log_marginal.shape)
 
-        # === COMPUTE CONDITIONAL BY SUBTRACTION IN LOG DOMAIN, THEN EXPONENTIATE
-        log_conditional = full_log_marginal - cond_log_marginal_rs
-        conditional = np.exp(log_conditional)
+        # === COMPUTE CONDITIONAL BY SUBTRACTION IN LOG DOMAIN, THEN EXPONENTIATE (IN PLACE)
+        with np.errstate(invalid="ignore"):
+            conditional = np.subtract(full_log_marginal, cond_log_marginal_rs, out=full_log_marginal)
+        np.exp(conditional, out=conditional)
 
         # === ACCOUNT FOR DIVISION BY ZERO
-        ixs = np.where(cond_log_marginal == -np.inf)
+        zero_mask = np.broadcast_to(np.isneginf(cond_log_marginal_rs), conditional.shape)
         marginal_alphabet_size = prod((self.node2dims[node] for node in marginal_nodes_no_repeats))
-        for ix in zip(*ixs):
-            full_index = (slice(None),) * len(marginal_nodes_no_repeats) + ix
-            conditional[full_index] = 1/marginal_alphabet_size
+        conditional[zero_mask] = 1/marginal_alphabet_size
 
         # === ACCOUNT FOR ANY NODES THAT ARE IN BOTH THE MARGINAL AND CONDITIONAL
         if len(marginal_nodes) != len(marginal_nodes_no_repeats):
-            marginal_nodes_repeat = [node for node in marginal_nodes if node in cond_nodes]
-            start_dims = " ".join([f"d{ix}" for ix in all_nodes])
-            end_dims = " ".join([
-                f"d{node}" if node in marginal_nodes_no_repeats else f"r{node}" 
-                for node in marginal_nodes
-            ])
-            end_dims += " " + " ".join([f"d{node}" for node in cond_nodes])
-            pattern = start_dims + " -> " + end_dims
-            repeats = {f"r{node}": self.node2dims[node] for node in marginal_nodes_repeat}
-            conditional = repeat(conditional, pattern, **repeats)
-
-            ones = [np.eye(self.node2dims[node]) for node in marginal_nodes_repeat]
-            if len(ones) > 1:
-                raise NotImplementedError
-            else:
-                ones = ones[0]
-                rep_node = marginal_nodes_repeat[0]
-                repeats = {f"d{node}": self.node2dims[node] for node in all_nodes if node != rep_node}
-                ones = repeat(ones, f"d{rep_node} r{rep_node} -> {end_dims}", **repeats)
-            conditional = conditional * ones
+            conditional = add_repeated_nodes_conditional(conditional, marginal_nodes, cond_nodes, self.node2dims)
         
         return conditional
 
@@ -721,6 +1104,16 @@ class DiscreteDAG(FunctionalDAG):
         variance = sum(terms)
         return mean, variance
     
+    def to_cupy(self):
+        import cupy as cp
+
+        if self._cupy_conditionals is None:
+            self._cupy_conditionals = {
+                node: cp.asarray(conditional)
+                for node, conditional in self.conditionals.items()
+            }
+        return self._cupy_conditionals
+
     def to_torch(self, device=None):
         import torch
         from graphical_models.classes.dags.discrete_dag_torch import DiscreteDAGTorch
@@ -752,10 +1145,11 @@ class DiscreteDAG(FunctionalDAG):
         bn = BayesianNetwork(nx_graph)
         for node in self.nodes:
             parents = self.node2parents[node]
-            parent_dims = [len(self.node_alphabets[par]) for par in parents]
-            card = len(self.node_alphabets[node])
+            parent_dims = [self.node2dims[par] for par in parents]
+            card = self.node2dims[node]
             conditional = self.conditionals[node]
-            conditional_rs = conditional.reshape(-1, conditional.shape[-1]).T
+            # === ONE CONTIGUOUS (card, parent configurations) COPY, SO PGMPY DOES NOT COPY AGAIN
+            conditional_rs = np.ascontiguousarray(np.moveaxis(conditional, -1, 0).reshape(card, -1))
             
             node_name = str(node) if as_string else node
             parent_names = [str(p) for p in parents] if as_string else parents
@@ -788,9 +1182,7 @@ class DiscreteDAG(FunctionalDAG):
 
             # === CONVERT CPD SO THAT `node` IS THE LAST DIMENSION ===
             vals = cpd.values
-            nparents = len(vals.shape) - 1
-            new_dims = list(range(1, nparents+1)) + [0]
-            conditionals[node_ix] = vals.transpose(new_dims)
+            conditionals[node_ix] = np.moveaxis(vals, 0, -1)
             
             # === SAVE THIS NODE'S ALPHABET ===
             node_alphabets[node_ix] = list(range(vals.shape[0]))
@@ -831,10 +1223,13 @@ class DiscreteDAG(FunctionalDAG):
             for node in dag.nodes:
                 node2parents[node] = list(dag.parents_of(node))
         
+        # === ONE VECTORIZED PASS FOR THE RANGE OF EVERY COLUMN
+        col_min, col_max = data.min(axis=0), data.max(axis=0)
+        
         if node_alphabets is None:
             node_alphabets = dict()
             for node in dag.nodes:
-                alphabet = list(range(max(data[:, node]) + 1))
+                alphabet = list(range(col_max[node] + 1))
                 node_alphabets[node] = alphabet
                 
         conditionals = dict()
@@ -849,7 +1244,7 @@ class DiscreteDAG(FunctionalDAG):
                 else:
                     parent_alphabets = [node_alphabets[p] for p in parents]
                     node_alphabet = node_alphabets[node]
-                    if len(set(data[:, node])) == 1:
+                    if col_min[node] == col_max[node]:
                         cc = indicator_conditional(parent_alphabets, node_alphabet, data[0, node])
                         conditionals[node] = cc
                     else:
@@ -883,7 +1278,78 @@ class DiscreteDAG(FunctionalDAG):
             node_alphabets
         )
 
-    def get_efficient_influence_function_conditionals(
+    def _get_standard_imset_cached(self, ignored_nodes=set()):
+        # === THE STANDARD IMSET ONLY DEPENDS ON THE (FIXED) GRAPH STRUCTURE; ZERO-COUNT
+        # === SETS ADD NOTHING TO THE EIF, SO THEY NEVER REACH INFERENCE OR THE KERNEL
+        key = frozenset(ignored_nodes)
+        if key not in self._imset_cache:
+            conds2counts = self.get_standard_imset(ignored_nodes=set(ignored_nodes))
+            self._imset_cache[key] = {cond_set: count for cond_set, count in conds2counts.items() if count != 0}
+        return dict(self._imset_cache[key])
+
+    def _get_joint_marginal_pgmpy(self, nodes: list, method: str = "variable_elimination"):
+        # === REUSE THE JOINT OVER THE SMALLEST CACHED SUPERSET OF THE REQUESTED NODES
+        key = frozenset(nodes)
+        supersets = [cached_key for cached_key in self._vecache if key <= cached_key]
+        superset = min(supersets, key=len) if supersets else None
+        if superset is None:
+            bn = self.to_pgm()
+            if method == "variable_elimination":
+                infer = VariableElimination(bn)
+            elif method == "belief_propagation":
+                infer = BeliefPropagation(bn)
+            else:
+                raise ValueError()
+            factor = infer.query(variables=list(key))
+            superset = key
+            self._vecache[key] = (list(factor.variables), factor.values)
+        
+        # === SUM OUT THE EXTRA NODES AND REORDER THE REMAINING AXES
+        cached_nodes, joint = self._vecache[superset]
+        extra_axes = tuple(ix for ix, node in enumerate(cached_nodes) if node not in key)
+        remaining_nodes = [node for node in cached_nodes if node in key]
+        joint = joint.sum(axis=extra_axes)
+        return np.transpose(joint, [remaining_nodes.index(node) for node in nodes])
+
+    def _get_conditional_expectation_pgmpy(
+        self,
+        row: int,
+        target_values: np.ndarray,
+        cond_ix: int,
+        target_ix: int,
+        cond_nodes: list,
+        method: str = "variable_elimination"
+    ):
+        # === E[1{cond_ix = row} * target_ix | cond_nodes] FOR EVERY ASSIGNMENT OF cond_nodes,
+        # === AS A RATIO OF TWO CONTRACTIONS OF THE JOINT; REPEATED NODES SHARE AN AXIS
+        nodes = list(dict.fromkeys([cond_ix, target_ix] + cond_nodes))
+        joint = self._get_joint_marginal_pgmpy(nodes, method)
+        if nodes[2:] == cond_nodes:
+            # === NO REPEATED NODES: THE JOINT IS (cond, target, *cond_nodes), SO ONLY ITS
+            # === cond = row SLICE ENTERS THE NUMERATOR, AS ONE MATVEC AGAINST target_values
+            numerator = np.tensordot(target_values, joint[row], axes=(0, 0))
+            denominator = joint.sum(axis=(0, 1))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return numerator / denominator
+        
+        values = np.zeros((self.node2dims[cond_ix], len(target_values)))
+        values[row] = target_values
+        node2symbol = {node: oe.get_symbol(ix) for ix, node in enumerate(nodes)}
+        joint_pattern = "".join(node2symbol[node] for node in nodes)
+        values_pattern = node2symbol[cond_ix] + node2symbol[target_ix]
+        cond_pattern = "".join(node2symbol[node] for node in cond_nodes)
+        numerator = oe.contract(f"{joint_pattern},{values_pattern}->{cond_pattern}", joint, values)
+        denominator = oe.contract(f"{joint_pattern}->{cond_pattern}", joint)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return numerator / denominator
+
+    def _get_eif_selector(self, target_ix: int, cond_ix: int, cond_value: int):
+        # === THE EIF INTEGRAND IS 1{cond_ix = cond_value} * target_ix, SO EVERY EXPECTATION ONLY
+        # === NEEDS THE cond_value ROW OF A (cond_ix, target_ix) TABLE, DOTTED WITH THE TARGET VALUES
+        row = np.flatnonzero(self._alphabet_arr[cond_ix] == cond_value)[0]
+        return row, self._alphabet_arr[target_ix]
+
+    def get_efficient_influence_function_conditionals_full(
         self, 
         target_ix: int, 
         cond_ix: int, 
@@ -892,26 +1358,34 @@ class DiscreteDAG(FunctionalDAG):
         inference_method="variable_elimination"
     ):
         # ADD TERMS FROM THE EFFICIENT INFLUENCE FUNCTION
-        conds2counts = self.get_standard_imset(ignored_nodes=ignored_nodes)
+        conds2counts = self._get_standard_imset_cached(ignored_nodes)
         
-        target_values = self.node_alphabets[target_ix]
-        indicator = np.array(self.node_alphabets[cond_ix]) == cond_value
-        values = np.outer(indicator, target_values)
+        row, target_values = self._get_eif_selector(target_ix, cond_ix, cond_value)
 
         conds2means = dict()
-        for cond_set in conds2counts:
+        # === LARGEST CONDITIONING SETS FIRST, SO SMALLER ONES ARE SUMMED OUT OF CACHED JOINTS
+        for cond_set in sorted(conds2counts, key=len, reverse=True):
             if len(cond_set) == 0:
                 probs = self.get_marginals([cond_ix, target_ix])
-                conds2means[cond_set] = (values * probs).sum()
+                conds2means[cond_set] = probs[row] @ target_values
             else:
                 # === COMPUTE CONDITIONAL EXPECTATION
                 clist = list(cond_set)
-                probs = self.get_conditional_pgmpy([cond_ix, target_ix], clist, method=inference_method)
-                values2 = values.reshape(values.shape + (1, ) * len(cond_set))
-                exp_val_function = (values2 * probs).sum((0, 1))
+                exp_val_function = self._get_conditional_expectation_pgmpy(
+                    row, 
+                    target_values, 
+                    cond_ix, 
+                    target_ix, 
+                    clist, 
+                    method=inference_method
+                )
                 conds2means[cond_set] = exp_val_function
         
+        if self.dtype is not None:
+            conds2means = {cond_set: np.asarray(mean, dtype=self.dtype) for cond_set, mean in conds2means.items()}
         return conds2counts, conds2means
+
+    get_efficient_influence_function_conditionals = get_efficient_influence_function_conditionals_full
         
     def get_efficient_influence_function_conditionals_partial(
         self, 
@@ -921,45 +1395,57 @@ class DiscreteDAG(FunctionalDAG):
         ignored_nodes = set(),
         sampled_values = None,
         inference_method="variable_elimination",
+        return_observed=False,
         **kwargs
     ):
         # ADD TERMS FROM THE EFFICIENT INFLUENCE FUNCTION
-        conds2counts = self.get_standard_imset(ignored_nodes=ignored_nodes)
+        conds2counts = self._get_standard_imset_cached(ignored_nodes)
         
-        target_values = self.node_alphabets[target_ix]
-        indicator = np.array(self.node_alphabets[cond_ix]) == cond_value
-        values = np.outer(indicator, target_values)
+        row, target_values = self._get_eif_selector(target_ix, cond_ix, cond_value)
 
         conds2means = dict()
-        for cond_set in conds2counts:
+        conds2observed = dict()
+        # === LARGEST CONDITIONING SETS FIRST, SO SMALLER ONES ARE SUMMED OUT OF CACHED JOINTS
+        for cond_set in sorted(conds2counts, key=len, reverse=True):
             if len(cond_set) == 0:
                 probs = self.get_marginals([cond_ix, target_ix])
-                conds2means[cond_set] = (values * probs).sum()
+                conds2means[cond_set] = probs[row] @ target_values
             else:
                 # === COMPUTE CONDITIONAL EXPECTATION
                 clist = list(cond_set)
-                cond_values = {tuple(val) for val in sampled_values[:, cond_set]}
                 
                 if inference_method == "importance_reweighting":
+                    # === DISTINCT OBSERVED CONDITIONING VALUES; TUPLES ONLY FOR THE DICT KEYS
+                    cond_values = list(map(tuple, np.unique(sampled_values[:, clist], axis=0)))
                     probs, _ = self.get_conditional_importance_sampling(
                         [cond_ix, target_ix],
                         clist,
                         cond_values,
                         nparticles=kwargs["nparticles"]
                     )
+                    # === DENSE TABLE OVER THE CONDITIONING VALUES, NaN WHERE NO SAMPLE WAS OBSERVED
+                    exp_val_function = np.full([len(self.node_alphabets[c]) for c in clist], np.nan)
+                    observed = np.zeros(exp_val_function.shape, dtype=bool)
+                    for cond_val, prob in probs.items():
+                        exp_val_function[cond_val] = prob[row] @ target_values
+                        observed[cond_val] = True
+                    conds2observed[cond_set] = observed
                 else:
-                    probs = self.get_conditional_pgmpy(
-                        [cond_ix, target_ix], 
+                    # === EXACT INFERENCE GIVES EVERY CONDITIONING VALUE AT ONCE FROM THE CACHED JOINT
+                    exp_val_function = self._get_conditional_expectation_pgmpy(
+                        row, 
+                        target_values, 
+                        cond_ix, 
+                        target_ix, 
                         clist, 
-                        cond_values, 
                         method=inference_method
                     )
-                exp_val_function = dict()
-                for cond_val, prob in probs.items():
-                    expval = (values * prob).sum()
-                    exp_val_function[cond_val] = expval
                 conds2means[cond_set] = exp_val_function
         
+        if self.dtype is not None:
+            conds2means = {cond_set: np.asarray(mean, dtype=self.dtype) for cond_set, mean in conds2means.items()}
+        if return_observed:
+            return conds2counts, conds2means, conds2observed
         return conds2counts, conds2means
     
     def get_efficient_influence_function_full(
@@ -979,21 +1465,12 @@ class DiscreteDAG(FunctionalDAG):
             inference_method=inference_method
         )
         
-        def efficient_influence_function(samples):
-            eif_terms = np.zeros((samples.shape[0], len(conds2means)))
-            for ix, cond_set in enumerate(conds2means):
-                conditional_mean = conds2means[cond_set]
-                
-                count = conds2counts[cond_set]
-                if len(cond_set) == 0:
-                    eif_terms[:, ix] = conditional_mean * count
-                else:
-                    ixs = samples[:, cond_set]
-                    eif_terms[:, ix] = conditional_mean[tuple(ixs.T)] * count
-            eif = np.sum(eif_terms, axis=1)
-            return eif / propensity
-
-        return efficient_influence_function
+        return build_efficient_influence_function(
+            conds2counts, 
+            conds2means, 
+            propensity, 
+            dtype=np.float64 if self.dtype is None else self.dtype
+        )
     
     def get_efficient_influence_function_partial(
         self, 
@@ -1006,32 +1483,24 @@ class DiscreteDAG(FunctionalDAG):
         inference_method="variable_elimination",
         **kwargs
     ):
-        conds2counts, conds2means = self.get_efficient_influence_function_conditionals_partial(
+        conds2counts, conds2means, conds2observed = self.get_efficient_influence_function_conditionals_partial(
             target_ix,
             cond_ix,
             cond_value,
             ignored_nodes=ignored_nodes,
             sampled_values=sampled_values,
             inference_method=inference_method,
+            return_observed=True,
             **kwargs
         )
         
-        def efficient_influence_function(samples):
-            eif_terms = np.zeros((samples.shape[0], len(conds2means)))
-            for ix, cond_set in enumerate(conds2means):
-                conditional_mean = conds2means[cond_set]
-                
-                count = conds2counts[cond_set]
-                if len(cond_set) == 0:
-                    eif_terms[:, ix] = conds2means[cond_set] * count
-                else:
-                    ixs = samples[:, cond_set]
-                    means = np.array([conditional_mean[tuple(ix)] for ix in ixs])
-                    eif_terms[:, ix] = means * count
-            eif = np.sum(eif_terms, axis=1)
-            return eif / propensity
-
-        return efficient_influence_function
+        return build_efficient_influence_function(
+            conds2counts, 
+            conds2means, 
+            propensity, 
+            dtype=np.float64 if self.dtype is None else self.dtype,
+            conds2observed=conds2observed
+        )
     
     def get_efficient_influence_function(
         self, 
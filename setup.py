@@ -18,6 +18,8 @@ setuptools.setup(
     install_requires=[
         'numpy',
         'einops',
+        'numba',
+        'opt_einsum',
         'pgmpy',
         'xgboost'
     ]
@@ -1,12 +1,190 @@
 from unittest import TestCase
 import unittest
 import numpy as np
-from graphical_models.classes.dags.discrete_dag import DiscreteDAG
+from graphical_models import DAG
+from graphical_models.classes.dags.discrete_dag import DiscreteDAG, get_conditional
+
+
+def _example_ddag():
+    conditional0 = np.array([0.3, 0.7])
+    conditional1 = np.array([[0.1, 0.6, 0.3], [0.5, 0.2, 0.3]])
+    conditional2 = np.array([
+        [[0.1, 0.9], [0.9, 0.1], [0.4, 0.6]],
+        [[0.8, 0.2], [0.2, 0.8], [0.5, 0.5]]
+    ])
+    return DiscreteDAG(
+        [0, 1, 2],
+        arcs={(0, 1), (0, 2), (1, 2)},
+        conditionals={0: conditional0, 1: conditional1, 2: conditional2},
+        node2parents={0: [], 1: [0], 2: [0, 1]},
+        node_alphabets={0: [0, 1], 1: [0, 1, 2], 2: [0, 1]}
+    )
+
+
+def _joint(ddag):
+    c = ddag.conditionals
+    return np.einsum("a,ab,abc->abc", c[0], c[1], c[2])
 
 
 class TestDiscreteDAG(TestCase):
+    def test_get_marginals(self):
+        ddag = _example_ddag()
+        joint = _joint(ddag)
+        marginal = ddag.get_marginals([2, 0])
+        self.assertTrue(np.allclose(marginal, joint.sum(axis=1).T))
+        marginal = ddag.get_marginal(2)
+        self.assertTrue(np.allclose(marginal, joint.sum(axis=(0, 1))))
+
+    def test_get_marginals_new(self):
+        ddag = _example_ddag()
+        joint = _joint(ddag)
+        marginal = ddag.get_marginals_new([2, 1])
+        self.assertTrue(np.allclose(marginal, joint.sum(axis=0).T))
+        log_marginal = ddag.get_marginals_new([2, 1], log=True)
+        self.assertTrue(np.allclose(log_marginal, np.log(marginal)))
+        marginal = ddag.get_marginals_new([0])
+        marginal[:] = 0
+        self.assertTrue(np.allclose(ddag.conditionals[0], [0.3, 0.7]))
+
+    def test_get_conditional_repeated_nodes(self):
+        ddag = _example_ddag()
+        joint = _joint(ddag)
+        # === expected[x2, y1, x1, x0] = P(x2 | x1, x0) * 1{y1 == x1}
+        conditional = joint / joint.sum(axis=2, keepdims=True)
+        expected = np.einsum("abc,bd->cdba", conditional, np.eye(3))
+        for method in ["new", "old"]:
+            self.assertTrue(np.allclose(ddag.get_conditional([2, 1], [1, 0], method=method), expected))
+        self.assertTrue(np.allclose(ddag.get_conditional_pgmpy([2, 1], [1, 0]), expected))
+        cond_values = [(0, 1), (2, 0)]
+        conditionals = ddag.get_conditional_pgmpy([2, 1], [1, 0], cond_values=cond_values)
+        for cond_value in cond_values:
+            self.assertTrue(np.allclose(conditionals[cond_value], expected[(..., ) + cond_value]))
+
+    def test_efficient_influence_function(self):
+        ddag = _example_ddag()
+        ddag = DiscreteDAG(
+            [0, 1, 2],
+            arcs={(0, 1), (1, 2)},
+            conditionals={0: ddag.conditionals[0], 1: ddag.conditionals[1], 2: ddag.conditionals[2][0]},
+            node2parents={0: [], 1: [0], 2: [1]},
+            node_alphabets=ddag.node_alphabets
+        )
+        np.random.seed(0)
+        samples = ddag.sample(200)
+        eif_partial = ddag.get_efficient_influence_function(2, 0, 1, sampled_values=samples, partial=True)
+        eif_full = ddag.get_efficient_influence_function(2, 0, 1, partial=False)
+        self.assertEqual(eif_full(samples).shape, (200, ))
+        self.assertTrue(np.allclose(eif_partial(samples), eif_full(samples)))
+
+        # === CONDITIONAL MEANS OF 1{X0 = 1} * X2 AGAINST THE BRUTE-FORCE JOINT OF THE CHAIN
+        c = ddag.conditionals
+        joint = np.einsum("a,ab,bc->abc", c[0], c[1], c[2])
+        weighted = joint * (np.arange(2) == 1)[:, None, None] * np.arange(2)[None, None, :]
+        conds2counts, conds2means = ddag.get_efficient_influence_function_conditionals(2, 0, 1)
+        self.assertTrue(any(len(cond_set) >= 2 for cond_set in conds2counts))
+        for cond_set, mean in conds2means.items():
+            pattern = "abc->" + "".join("abc"[node] for node in cond_set)
+            expected_mean = np.einsum(pattern, weighted) / np.einsum(pattern, joint)
+            self.assertTrue(np.allclose(mean, expected_mean))
+
+        # === EIF AS A PLAIN NUMPY SUM OF GATHERED MEANS
+        propensity = ddag.get_marginal(0)[1]
+        expected = sum(
+            count * np.asarray(conds2means[cond_set])[tuple(samples[:, list(cond_set)].T)]
+            for cond_set, count in conds2counts.items()
+        ) / propensity
+        self.assertTrue(np.allclose(eif_full(samples), expected))
+        bad_samples = samples.copy()
+        bad_samples[0, 2] = 7
+        self.assertRaises(IndexError, eif_full, bad_samples)
+        bad_samples[0, 2] = -1
+        self.assertRaises(IndexError, eif_full, bad_samples)
+        self.assertRaises(ValueError, ddag.get_efficient_influence_function, 2, 0, 1, propensity=0.0, partial=False)
+
+        # === IMPORTANCE REWEIGHTING ONLY ESTIMATES MEANS AT CONDITIONING VALUES SEEN IN sampled_values
+        seen = np.array([[0, 0, 0], [0, 0, 1]])
+        eif_is = ddag.get_efficient_influence_function(
+            2, 0, 1, sampled_values=seen, partial=True, inference_method="importance_reweighting", nparticles=100
+        )
+        self.assertEqual(eif_is(seen).shape, (2, ))
+        self.assertRaises(KeyError, eif_is, np.array([[0, 0, 0], [1, 2, 1]]))
+        out = np.full(200, np.nan)
+        self.assertIs(eif_full(samples, out=out), out)
+        self.assertTrue(np.allclose(out, eif_full(samples)))
+        self.assertRaises(ValueError, eif_full, samples, out=np.zeros(2))
+        self.assertRaises(ValueError, eif_full, samples, out=np.zeros(200, dtype=np.float32))
+
+    def test_efficient_influence_function_float32(self):
+        ddag = _example_ddag()
+        ddag32 = DiscreteDAG(
+            [0, 1, 2],
+            arcs=ddag.arcs,
+            conditionals=ddag.conditionals,
+            node2parents=ddag.node2parents,
+            node_alphabets=ddag.node_alphabets,
+            dtype=np.float32
+        )
+        np.random.seed(0)
+        samples = ddag.sample(200)
+        eif = ddag.get_efficient_influence_function(2, 1, 2, partial=False)
+        eif32 = ddag32.get_efficient_influence_function(2, 1, 2, partial=False)
+        self.assertEqual(eif32(samples).dtype, np.float32)
+        self.assertTrue(np.allclose(eif32(samples), eif(samples), atol=1e-4))
+
+    def test_copy(self):
+        ddag = _example_ddag()
+        ddag_copy = ddag.copy()
+        ddag_copy.set_conditional(0, np.array([1.0, 0.0]))
+        self.assertTrue(np.allclose(ddag_copy.get_marginal(0), [1.0, 0.0]))
+        self.assertTrue(np.allclose(ddag.get_marginal(0), [0.3, 0.7]))
+        ddag_int = ddag.get_hard_interventional_dag(1, 2)
+        self.assertTrue(np.allclose(ddag_int.get_marginal(1), [0, 0, 1]))
+        self.assertTrue(np.allclose(ddag.get_marginal(1), _joint(ddag).sum(axis=(0, 2))))
+
+    def test_fit(self):
+        # === NODE ALPHABET [5, 7, 9] IS NOT range(k), AND THE VALUE 4 IS OUTSIDE IT
+        data = np.array([[0, 5], [0, 5], [0, 7], [0, 4], [1, 9], [1, 4]])
+        conditional = get_conditional(data, 1, [5, 7, 9], [0], [[0, 1, 2]])
+        expected = np.array([[2/3, 1/3, 0], [0, 0, 1], [1/3, 1/3, 1/3]])
+        self.assertTrue(np.allclose(conditional, expected))
+        # === ADD-ONE SMOOTHING ONLY TOUCHES OBSERVED PARENT ROWS
+        conditional = get_conditional(data, 1, [5, 7, 9], [0], [[0, 1, 2]], add_one=True)
+        expected = np.array([[3/6, 2/6, 1/6], [1/4, 1/4, 2/4], [1/3, 1/3, 1/3]])
+        self.assertTrue(np.allclose(conditional, expected))
+        self.assertTrue(np.allclose(get_conditional(data, 1, [5, 7, 9], [], []), [2/4, 1/4, 1/4]))
+        self.assertTrue(np.allclose(get_conditional(data, 1, [5, 7, 9], [], [], add_one=True), [3/7, 2/7, 2/7]))
+
+        data = np.array([[0, 1], [0, 1], [0, 0], [2, 1]])
+        ddag = DiscreteDAG.fit(DAG(nodes={0, 1}, arcs={(0, 1)}), data)
+        self.assertEqual(ddag.node_alphabets, {0: [0, 1, 2], 1: [0, 1]})
+        self.assertTrue(np.allclose(ddag.conditionals[0], [3/4, 0, 1/4]))
+        self.assertTrue(np.allclose(ddag.conditionals[1], [[1/3, 2/3], [1/2, 1/2], [0, 1]]))
+
+    def test_predict_from_parents(self):
+        ddag = _example_ddag()
+        parent_vals = np.array([[0, 2], [1, 0], [1, 1]])
+        predictions = ddag.predict_from_parents(2, parent_vals)
+        self.assertEqual(predictions.shape, (3, 2))
+        self.assertTrue((predictions == ddag.conditionals[2][tuple(parent_vals.T)]).all())
+        predictions = ddag.predict_from_parents(1, parent_vals[:, :1])
+        self.assertTrue((predictions == ddag.conditionals[1][[0, 1, 1]]).all())
+
     def test_sample(self):
-        pass
+        ddag = _example_ddag()
+        np.random.seed(0)
+        samples = ddag.sample(20000)
+        self.assertEqual(samples.shape, (20000, 3))
+        counts = np.zeros((2, 3, 2))
+        np.add.at(counts, tuple(samples.T), 1)
+        self.assertTrue(np.allclose(counts / 20000, _joint(ddag), atol=0.02))
+        ddag = DiscreteDAG(
+            [0, 1],
+            arcs={(0, 1)},
+            conditionals={0: np.array([0.5, 0.5]), 1: np.array([[0.2, 0.8], [0.9, 0.1]])},
+            node2parents={0: [], 1: [0]},
+            node_alphabets={0: [1, 2], 1: [0, 1]}
+        )
+        self.assertRaises(IndexError, ddag.sample, 10)
         # dag = GaussDAG(nodes=[0, 1], arcs={(0, 1)})
         # samples = dag.sample(100)
         # self.assertEqual(samples.shape, (100, 2))